@@ -1,17 +1,22 @@
 from abc import abstractmethod
 import math
 import copy
-import pandas as pd
-from matplotlib import pyplot
+import itertools
+import json
+from collections import OrderedDict
+import os
+import queue
 import random
-from tqdm import trange 
-from numpy.random import RandomState
-from sklearn import preprocessing
-from imblearn.over_sampling import ADASYN,SMOTE
+import threading
+
+# pandas, matplotlib, sklearn, imblearn i tqdm se uvoze tek kada zatrebaju,
+# kako bi ucitavanje tezina i predict (inferenca) bili brzi pri pokretanju
 
 
 random.seed(1337)
 
+_weights_versions = itertools.count(1)  # globalni brojac verzija tezina neurona
+
 
 class ComputationalNode(object):
 
@@ -171,6 +176,9 @@ class NeuronNode(ComputationalNode):
 
         self.previous_deltas = [0.] * (self.n_inputs + 1)
         self.gradients = []
+        self.mask = None  # posle orezivanja: False za ulaze cije su tezine uklonjene
+        self.sparse_weights = None  # retki zapis tezina: lista (indeks ulaza, tezina) i bias
+        self.weights_version = next(_weights_versions)  # nova vrednost pri svakoj promeni tezina
 
     def forward(self, x):  # x je vektor ulaza u neuron, odnosno lista skalara
         x = copy.copy(x)
@@ -187,21 +195,26 @@ class NeuronNode(ComputationalNode):
         summed_act = self.activation_node.forward(summed)
         return summed_act
 
-    def backward(self, dz):
+    def backward(self, dz, skip_activation=False):
         dw = []
+        dx = []
         # print(dz)
-        d = dz[0] if type(dz[0]) == float else sum(dz)  # u d se nalazi spoljasnji gradijent izlaza neurona
+        # u d se nalazi spoljasnji gradijent izlaza neurona, zbir gradijenata svih neurona sledeceg sloja
+        d = sum(dz)
 
         # TODO 8: implementirati backward-pass za vestacki neuron
         # iskoristiti backward-pass za aktivacionu funkciju, sabirac i mnozace da bi se dobili gradijenti te
         # izracunate gradijente tezina ubaciti u listu dw
-        act = self.activation_node.backward(d)
+        # skip_activation: d je vec gradijent po ulazu aktivacije (fuzionisana funkcija greske)
+        act = d if skip_activation else self.activation_node.backward(d)
         summed_act = self.sum_node.backward(act)
         for i, bb in enumerate(summed_act):
-            dw.append(self.multiply_nodes[i].backward(bb)[1])
+            dmul = self.multiply_nodes[i].backward(bb)
+            dx.append(dmul[0])  # gradijent po ulazu, propagira se u prethodni sloj
+            dw.append(dmul[1])  # gradijent po tezini
 
         self.gradients.append(dw)
-        return dw
+        return dx
 
     def update_weights(self, learning_rate, momentum):
         # azuriranje tezina vestackog neurona
@@ -217,6 +230,64 @@ class NeuronNode(ComputationalNode):
 
         self.gradients = []  # ciscenje liste gradijenata (da sve bude cisto za sledecu iteraciju)
 
+        if self.mask is not None:  # orezane tezine ostaju nula i tokom dotreniravanja
+            for i, keep in enumerate(self.mask):
+                if not keep:
+                    self.multiply_nodes[i].x[1] = 0.
+                    self.previous_deltas[i] = 0.
+        if self.sparse_weights is not None:
+            self.to_sparse()
+        self.weights_version = next(_weights_versions)
+
+    def prune(self, threshold):
+        # uklanjanje ulaznih tezina (ne i bias-a) ciji je moduo manji od praga
+        if self.mask is None:
+            self.mask = [True] * (self.n_inputs + 1)
+        for i in range(self.n_inputs):
+            if abs(self.multiply_nodes[i].x[1]) < threshold:
+                self.multiply_nodes[i].x[1] = 0.
+                self.previous_deltas[i] = 0.
+                self.mask[i] = False
+        if self.sparse_weights is not None:
+            self.to_sparse()
+        self.weights_version = next(_weights_versions)
+
+    def to_sparse(self):
+        self.sparse_weights = ([(i, mn.x[1]) for i, mn in enumerate(self.multiply_nodes[:-1]) if mn.x[1] != 0.],
+                               self.multiply_nodes[-1].x[1])
+
+    def forward_sparse(self, x):
+        # forward-pass samo preko nenultih tezina, bez cvorova grafa (koristi se za predict)
+        weights, bias = self.sparse_weights
+        summed = bias
+        for i, w in weights:
+            summed += x[i] * w
+        return self.activation_node.forward(summed)
+
+    def forward_mixed(self, x):
+        # x je SparseInput: gusti proizvod nad numerickim ulazima + zbir tezina aktivnih kategorija
+        n_dense = len(x.dense)
+        summed = self.multiply_nodes[-1].x[1]  # bias
+        for i, v in enumerate(x.dense):
+            summed += v * self.multiply_nodes[i].x[1]
+        for k in x.active:
+            summed += self.multiply_nodes[n_dense + k].x[1]
+        return self.activation_node.forward(summed)
+
+
+class SparseInput(object):
+
+    def __init__(self, dense, active):
+        """
+        Ulaz sa numerickim delom i retkim one-hot delom, za prvi sloj mreze.
+        Ekvivalentan je gustom vektoru dense + one-hot kolone, gde su jedinice
+        samo na pozicijama iz active. Koristi se za forward/predict, ne za treniranje.
+        :param dense: vrednosti numerickih kolona (prve kolone ulaza).
+        :param active: indeksi aktivnih one-hot kolona, racunato od prve one-hot kolone.
+        """
+        self.dense = dense
+        self.active = active
+
 
 class NeuralLayer(ComputationalNode):
 
@@ -232,6 +303,9 @@ class NeuralLayer(ComputationalNode):
             self.neurons.append(neuron)
 
     def forward(self, x):  # x je vektor, odnosno lista "n_inputs" elemenata
+        if isinstance(x, SparseInput):
+            return [neuron.forward_mixed(x) for neuron in self.neurons]
+
         layer_output = []
         # forward-pass za sloj neurona je zapravo forward-pass za svaki neuron u sloju nad zadatim ulazom x
         for neuron in self.neurons:
@@ -240,13 +314,13 @@ class NeuralLayer(ComputationalNode):
 
         return layer_output
 
-    def backward(self, dz):  # dz je vektor, odnosno lista "n_neurons" elemenata
+    def backward(self, dz, skip_activation=False):  # dz je vektor, odnosno lista "n_neurons" elemenata
         dd = []
         # backward-pass za sloj neurona je zapravo backward-pass za svaki neuron u sloju nad
         # zadatim spoljasnjim gradijentima dz
         for i, neuron in enumerate(self.neurons):
             neuron_dz = [d[i] for d in dz]
-            neuron_dz = neuron.backward(neuron_dz)
+            neuron_dz = neuron.backward(neuron_dz, skip_activation)
             dd.append(neuron_dz[:-1])  # izuzimamo gradijent za bias jer se on ne propagira unazad
 
         return dd
@@ -256,11 +330,35 @@ class NeuralLayer(ComputationalNode):
         for neuron in self.neurons:
             neuron.update_weights(learning_rate, momentum)
 
+    def prune(self, threshold):
+        for neuron in self.neurons:
+            neuron.prune(threshold)
+
+    def to_sparse(self):
+        for neuron in self.neurons:
+            neuron.to_sparse()
+
+    def forward_sparse(self, x):
+        if isinstance(x, SparseInput):
+            return [neuron.forward_mixed(x) for neuron in self.neurons]
+        return [neuron.forward_sparse(x) for neuron in self.neurons]
+
 
 class NeuralNetwork(ComputationalNode):
 
     def __init__(self):
         self.layers = []  # neuronska mreza se sastoji od slojeva neurona
+        self.sparse = False  # da li predict koristi retki zapis tezina
+        self.preprocessing = None  # fitovan Preprocessing kojim su pripremljeni ulazi
+        # parametri poslednjeg fit/partial_fit, podrazumevani za sledeci partial_fit
+        self.learning_rate = 0.1
+        self.momentum = 0.0
+        self.loss = 'mse'
+        self.cache = None  # LRU kes predikcija (OrderedDict), ukljucuje se sa enable_cache
+        self.cache_version = None  # verzija tezina za koju vaze predikcije iz kesa
+        self.cache_size = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def add(self, layer):
         self.layers.append(layer)
@@ -277,14 +375,15 @@ class NeuralNetwork(ComputationalNode):
                 prev_layer_output = layer.forward(prev_layer_output)
         return prev_layer_output  # actually an output from last layer
 
-    def backward(self, dz):
+    def backward(self, dz, skip_activation=False):
         # TODO 10: implementirati forward-pass za celu neuronsku mrezu
         # spoljasnji gradijent za izlazni sloj neurona je dz
         # spoljasnji gradijenti za ostale slojeve su izracunati gradijenti iz sledeceg sloja
+        # skip_activation se odnosi samo na izlazni sloj (fuzionisana funkcija greske)
         next_layer_dz = None
         for idx, layer in enumerate(self.layers[::-1]):
             if idx == 0:
-                next_layer_dz = layer.backward(dz)
+                next_layer_dz = layer.backward(dz, skip_activation)
             else:
                 next_layer_dz = layer.backward(next_layer_dz)
         return next_layer_dz
@@ -294,56 +393,613 @@ class NeuralNetwork(ComputationalNode):
         for layer in self.layers:
             layer.update_weights(learning_rate, momentum)
 
-    def fit(self, X, Y, learning_rate=0.1, momentum=0.0, nb_epochs=10, shuffle=False, verbose=0):
+    def weights_version(self):
+        # najnovija verzija tezina medju neuronima; menja se pri svakoj promeni tezina
+        # bilo kog neurona (i kada se menja direktno preko sloja ili neurona) i pri dodavanju sloja
+        return max([neuron.weights_version for layer in self.layers for neuron in layer.neurons] or [0])
+
+    def fit(self, X, Y, learning_rate=0.1, momentum=0.0, nb_epochs=10, shuffle=False, verbose=0, loss='mse',
+            checkpoint_path=None, checkpoint_every=1, checkpoint_every_batches=None, resume=False):
+        """
+        Treniranje mreze. loss je 'mse' (kvadratna greska) ili 'bce' (binarna
+        unakrsna entropija, fuzionisana sa sigmoidom izlaznog sloja). Ako je zadat checkpoint_path, stanje treniranja (tezine,
+        momentum, epoha, pozicija u epohi i istorija greske) se cuva na svakih
+        checkpoint_every epoha i, opciono, na svakih checkpoint_every_batches primera.
+        Upis radi pozadinska nit, a fajl se zamenjuje atomicno.
+        Sa resume=True treniranje se nastavlja od poslednjeg checkpoint-a, sa istim
+        rezultatom kao neprekinuto treniranje; X i Y tada treba da budu u
+        originalnom redosledu, kao na pocetku prvog pokretanja.
+        """
+        from tqdm import trange
+
         assert len(X) == len(Y)
+        if checkpoint_every < 1:
+            raise ValueError('checkpoint_every must be at least 1.')
+        if checkpoint_every_batches is not None and checkpoint_every_batches < 1:
+            raise ValueError('checkpoint_every_batches must be at least 1.')
+        self.learning_rate, self.momentum, self.loss = learning_rate, momentum, loss
+        loss = self._get_loss(loss)
 
         hist = []  # za plotovanje funkcije greske kroz epohe
-        for epoch in trange(nb_epochs):
-            if shuffle:  # izmesati podatke
-                random.seed(epoch)
-                random.shuffle(X)
-                random.seed(epoch)
-                random.shuffle(Y)
-
-            total_loss = 0.0
-            for x, y in zip(X, Y):
-                y_pred = self.forward(x)  # forward-pass da izracunamo izlaz
-                y_target = y  # zeljeni izlaz
-                grad = 0.0
-                for p, t in zip(y_pred, y_target):
-                    total_loss += 0.5 * (t - p) ** 2.  # funkcija greske je kvadratna greska
-                    # total_loss +=self.CrossEntropy(p, t)
-                    grad += -(t - p)  # gradijent funkcije greske u odnosu na izlaz
-                    # print(grad)
-                # backward-pass da izracunamo gradijente tezina
-                self.backward([[grad]])
-                # azuriranje tezina na osnovu izracunatih gradijenata i koraka "learning_rate"
-                self.update_weights(learning_rate, momentum)
-
-            if verbose == 1:
-                print('Epoch {0}: loss {1}'.format(epoch + 1, total_loss))
-            hist.append(total_loss)
+        start_epoch = start_batch = 0
+        total_loss = 0.0
+        if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r') as f:
+                state = json.load(f)
+            self._set_state(state)
+            start_epoch, start_batch = state['epoch'], state['batch']
+            total_loss, hist = state['total_loss'], state['hist']
+            if shuffle:  # ponavljamo mesanja prethodnih epoha da bi redosled bio isti
+                for epoch in range(start_epoch):
+                    random.seed(epoch)
+                    random.shuffle(X)
+                    random.seed(epoch)
+                    random.shuffle(Y)
+
+        writer = CheckpointWriter(checkpoint_path) if checkpoint_path is not None else None
+        try:
+            for epoch in trange(start_epoch, nb_epochs):
+                if shuffle:  # izmesati podatke
+                    random.seed(epoch)
+                    random.shuffle(X)
+                    random.seed(epoch)
+                    random.shuffle(Y)
+
+                if epoch != start_epoch or start_batch == 0:
+                    total_loss = 0.0
+                first = start_batch if epoch == start_epoch else 0
+                for i in range(first, len(X)):
+                    total_loss += self._train_step(X[i], Y[i], learning_rate, momentum, loss)
+                    if writer is not None and checkpoint_every_batches and (i + 1) % checkpoint_every_batches == 0 \
+                            and i + 1 < len(X):
+                        writer.write(self._get_state(epoch, i + 1, total_loss, hist))
+
+                if verbose == 1:
+                    print('Epoch {0}: loss {1}'.format(epoch + 1, total_loss))
+                hist.append(total_loss)
+
+                if writer is not None and ((epoch + 1) % checkpoint_every == 0 or epoch + 1 == nb_epochs):
+                    writer.write(self._get_state(epoch + 1, 0, total_loss, hist))
+        except BaseException:
+            # greska upisa ne sme da sakrije originalni izuzetak (npr. KeyboardInterrupt)
+            if writer is not None:
+                writer.close(raise_error=False)
+            raise
+        if writer is not None:
+            writer.close()
 
         print('Loss: {0}'.format(total_loss))
         return hist
 
+    def _get_state(self, epoch, batch, total_loss, hist):
+        # kopija celokupnog stanja treniranja, pravi se u niti koja trenira
+        return {
+            'layers': self._layers_data(),
+            'previous_deltas': [[copy.copy(neuron.previous_deltas) for neuron in layer.neurons]
+                                for layer in self.layers],
+            'masks': [[copy.copy(neuron.mask) for neuron in layer.neurons] for layer in self.layers],
+            'epoch': epoch,
+            'batch': batch,
+            'total_loss': total_loss,
+            'hist': copy.copy(hist),
+        }
+
+    def _set_state(self, state):
+        self._set_weights(state['layers'])
+        for layer, deltas, masks in zip(self.layers, state['previous_deltas'], state['masks']):
+            for neuron, neuron_deltas, mask in zip(layer.neurons, deltas, masks):
+                neuron.previous_deltas = neuron_deltas
+                neuron.mask = mask
+                if neuron.sparse_weights is not None:
+                    neuron.to_sparse()
+
+    def partial_fit(self, X, Y, learning_rate=None, momentum=None, max_updates=100, loss=None):
+        """
+        Dotreniravanje postojecih tezina na novim primerima, bez ponovne inicijalizacije.
+        Svi primeri se koriste: dele se u najvise max_updates mini-batch-eva, a tezine
+        se azuriraju jednom po mini-batch-u (prosek gradijenata). Momentum (previous_deltas)
+        se cuva izmedju poziva; learning_rate, momentum i loss su podrazumevano oni iz
+        poslednjeg fit/partial_fit. Ulazi moraju biti pripremljeni istim fitovanim
+        Preprocessing-om kao i podaci za treniranje (npr. nn.preprocessing.transform).
+        :return: greska nad svim primerima.
+        """
+        assert len(X) == len(Y)
+        if max_updates < 1:
+            raise ValueError('max_updates must be at least 1.')
+        learning_rate = self.learning_rate if learning_rate is None else learning_rate
+        momentum = self.momentum if momentum is None else momentum
+        loss = self.loss if loss is None else loss
+        self.learning_rate, self.momentum, self.loss = learning_rate, momentum, loss
+        loss = self._get_loss(loss)
+
+        total_loss = 0.0
+        n_batches = min(max_updates, len(X))
+        for b in range(n_batches):
+            for i in range(b * len(X) // n_batches, (b + 1) * len(X) // n_batches):
+                total_loss += self._backward_step(X[i], Y[i], loss)
+            self.update_weights(learning_rate, momentum)
+        return total_loss
+
+    def _get_loss(self, name):
+        if name == 'mse':
+            return MeanSquaredError()
+        elif name == 'bce':
+            if self.layers[-1].activation != 'sigmoid':
+                raise RuntimeError('Loss "bce" requires a sigmoid output layer.')
+            return BinaryCrossEntropy()
+        raise RuntimeError('Unknown loss function "{0}".'.format(name))
+
+    def _train_step(self, x, y, learning_rate, momentum, loss):
+        loss_value = self._backward_step(x, y, loss)
+        # azuriranje tezina na osnovu izracunatih gradijenata i koraka "learning_rate"
+        self.update_weights(learning_rate, momentum)
+        return loss_value
+
+    def _backward_step(self, x, y, loss):
+        # forward i backward za jedan primer; gradijenti tezina ostaju u neuronima do update_weights
+        if isinstance(x, SparseInput):
+            raise RuntimeError('SparseInput is supported only for forward and predict.')
+        y_pred = self.forward(x)  # forward-pass da izracunamo izlaz
+        z = [neuron.activation_node.x for neuron in self.layers[-1].neurons]  # ulazi aktivacija izlaznog sloja
+        # gradijent za svaki izlaz posebno, a ne jedan zbirni skalar
+        grad = loss.gradient(y_pred, y, z)
+        # backward-pass da izracunamo gradijente tezina
+        self.backward([grad], skip_activation=loss.fused)
+        return loss.loss(y_pred, y, z)
+
     def predict(self, x):
+        if self.cache is None:
+            return self._predict(x)
+
+        version = self.weights_version()
+        if version != self.cache_version:  # predikcije iz kesa vaze samo za tezine sa kojima su izracunate
+            self.cache.clear()
+            self.cache_version = version
+
+        key = (tuple(x.dense), tuple(x.active)) if isinstance(x, SparseInput) else tuple(x)
+        if key in self.cache:
+            self.cache_hits += 1
+            self.cache.move_to_end(key)
+            return list(self.cache[key])
+
+        self.cache_misses += 1
+        y = self._predict(x)
+        self.cache[key] = tuple(y)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)  # izbacujemo najdavnije korisceni ulaz
+        return y
+
+    def _predict(self, x):
+        if self.sparse:
+            for layer in self.layers:
+                x = layer.forward_sparse(x)
+            return x
         return self.forward(x)
 
+    def enable_cache(self, max_size=1024):
+        """
+        Ukljucivanje ogranicenog LRU kesa za predict, sa kljucem po ulaznom vektoru.
+        Kes se prazni kada se promeni verzija tezina (weights_version), tj. posle
+        update_weights, prune ili ucitavanja tezina, i na nivou sloja ili neurona.
+        :param max_size: najveci broj zapamcenih ulaza.
+        """
+        self.cache = OrderedDict()
+        self.cache_version = self.weights_version()
+        self.cache_size = max_size
+        self.cache_hits = self.cache_misses = 0
+
+    def disable_cache(self):
+        self.cache = None
+
+    def cache_info(self):
+        return {'hits': self.cache_hits, 'misses': self.cache_misses,
+                'size': len(self.cache) if self.cache is not None else 0, 'max_size': self.cache_size}
+
+    def prune(self, threshold=None, sparsity=None):
+        """
+        Orezivanje tezina po modulu. Zadaje se ili prag, ili ciljni udeo nula
+        (sparsity) medju ulaznim tezinama cele mreze.
+        :return: postignut udeo nultih tezina.
+        """
+        if threshold is None:
+            if sparsity is None:
+                raise ValueError('Either threshold or sparsity must be given.')
+            magnitudes = sorted(abs(mn.x[1]) for layer in self.layers for neuron in layer.neurons
+                                for mn in neuron.multiply_nodes[:-1])
+            k = int(round(sparsity * len(magnitudes)))
+            threshold = magnitudes[k] if k < len(magnitudes) else float('inf')
+        for layer in self.layers:
+            layer.prune(threshold)
+        return self.sparsity()
+
+    def sparsity(self):
+        weights = [mn.x[1] for layer in self.layers for neuron in layer.neurons for mn in neuron.multiply_nodes[:-1]]
+        return sum(1 for w in weights if w == 0.) / len(weights)
+
+    def to_sparse(self):
+        # predict ce ubuduce racunati samo preko nenultih tezina
+        for layer in self.layers:
+            layer.to_sparse()
+        self.sparse = True
+
+    def quantize(self, X_calib, per_neuron=True):
+        # post-training int8 kvantizacija, X_calib je uzorak podataka za treniranje
+        return QuantizedNeuralNetwork(self, X_calib, per_neuron)
+
+    def save(self, file_path):
+        """
+        Cuvanje arhitekture i tezina mreze u JSON fajl.
+        :param file_path: putanja fajla.
+        """
+        data = {'layers': self._layers_data()}
+        if self.preprocessing is not None:
+            data['preprocessing'] = self.preprocessing.to_dict()
+        with open(file_path, 'w') as f:
+            json.dump(data, f)
+
+    def _layers_data(self):
+        layers = []
+        for layer in self.layers:
+            layers.append({
+                'n_inputs': layer.n_inputs,
+                'n_neurons': layer.n_neurons,
+                'activation': layer.activation,
+                'weights': [[mn.x[1] for mn in neuron.multiply_nodes] for neuron in layer.neurons],
+            })
+        return layers
+
+    def _set_weights(self, layers_data):
+        for layer, layer_data in zip(self.layers, layers_data):
+            for neuron, weights in zip(layer.neurons, layer_data['weights']):
+                for mn, w in zip(neuron.multiply_nodes, weights):
+                    mn.x[1] = w
+                neuron.weights_version = next(_weights_versions)
+
+
+class MeanSquaredError(object):
+    # kvadratna greska, gradijent je po izlazu mreze
+    fused = False
+
+    def loss(self, y_pred, y_true, z):
+        return sum([0.5 * (t - p) ** 2. for p, t in zip(y_pred, y_true)])
+
+    def gradient(self, y_pred, y_true, z):
+        return [-(t - p) for p, t in zip(y_pred, y_true)]
+
+
+class BinaryCrossEntropy(object):
+    # binarna unakrsna entropija fuzionisana sa sigmoidom: racuna se iz ulaza sigmoide z,
+    # a gradijent je direktno po z (sigmoid(z) - t), pa se SigmoidNode.backward preskace
+    fused = True
+
+    def loss(self, y_pred, y_true, z):
+        # max(z, 0) - z*t + log(1 + e^-|z|), stabilno i za veliko |z|
+        return sum([max(zz, 0.) - zz * t + math.log1p(math.exp(-abs(zz))) for zz, t in zip(z, y_true)])
+
+    def gradient(self, y_pred, y_true, z):
+        return [self._sigmoid(zz) - t for zz, t in zip(z, y_true)]
+
+    def _sigmoid(self, z):
+        if z >= 0.:
+            return 1. / (1. + math.exp(-z))
+        e = math.exp(z)
+        return e / (1. + e)
+
+
+class CheckpointWriter(object):
+
+    def __init__(self, file_path):
+        """
+        Pozadinska nit koja upisuje checkpoint-e, da treniranje ne bi cekalo na disk.
+        Fajl se prvo upisuje pod privremenim imenom, pa se atomicno zamenjuje.
+        :param file_path: putanja checkpoint fajla.
+        """
+        self.file_path = file_path
+        self.queue = queue.Queue(maxsize=1)  # cuva se samo najnoviji snapshot koji ceka na upis
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, state):
+        # ako disk kasni, stariji snapshot koji jos ceka se odbacuje, pa memorija ostaje ogranicena
+        while True:
+            try:
+                self.queue.put_nowait(state)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def close(self, raise_error=True):
+        # ceka da se upise poslednji snapshot; greska upisa se podize ili samo ispisuje
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            if raise_error:
+                raise self.error
+            print('Checkpoint write failed: {0}'.format(self.error))
+
+    def _run(self):
+        while True:
+            state = self.queue.get()
+            if state is None:
+                break
+            try:
+                tmp_path = self.file_path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(state, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.file_path)
+            except Exception as e:
+                self.error = e
+
+
+def load_network(file_path):
+    """
+    Ucitavanje mreze sacuvane sa NeuralNetwork.save. Uvozi samo ono sto je
+    potrebno za forward-pass, pa je pogodno za kratke poslove skorovanja.
+    :param file_path: putanja fajla.
+    """
+    with open(file_path, 'r') as f:
+        data = json.load(f)
+
+    nn = NeuralNetwork()
+    for layer_data in data['layers']:
+        nn.add(NeuralLayer(layer_data['n_inputs'], layer_data['n_neurons'], layer_data['activation']))
+    nn._set_weights(data['layers'])
+    if 'preprocessing' in data:
+        nn.preprocessing = Preprocessing.from_dict(data['preprocessing'])
+    return nn
+
+
+def _int8_scale(max_abs):
+    # simetricna kvantizacija: [-max_abs, max_abs] se preslikava na [-127, 127]
+    import numpy as np
+
+    max_abs = np.asarray(max_abs, dtype=np.float64)
+    return np.where(max_abs > 0., max_abs / 127., 1.)
+
+
+def _activate(z, activation):
+    import numpy as np
+
+    if activation == 'sigmoid':
+        return np.exp(-np.logaddexp(0., -z))
+    elif activation == 'relu':
+        return np.maximum(0., z)
+    elif activation == 'lin':
+        return z
+    elif activation == 'tanh':
+        return np.tanh(z)
+    raise RuntimeError('Unknown activation function "{0}".'.format(activation))
+
+
+class BatchNeuralNetwork(object):
+
+    def __init__(self, nn):
+        """
+        Float kopija tezina mreze u numpy matricama, za inferencu nad celim
+        skupom redova odjednom (jedan matricni proizvod po sloju).
+        """
+        import numpy as np
+
+        self.layers = []  # (tezine, bias, aktivacija)
+        for layer in nn.layers:
+            W = np.array([[mn.x[1] for mn in neuron.multiply_nodes[:-1]] for neuron in layer.neurons])
+            b = np.array([neuron.multiply_nodes[-1].x[1] for neuron in layer.neurons])
+            self.layers.append((W, b, layer.activation))
+
+    def predict_batch(self, X):
+        import numpy as np
+
+        x = np.asarray(X, dtype=np.float64)
+        for W, b, activation in self.layers:
+            x = _activate(x.dot(W.T) + b, activation)
+        return x.tolist()
+
+    def predict(self, x):
+        return self.predict_batch([x])[0]
+
+
+class QuantizedNeuralNetwork(object):
+
+    def __init__(self, nn, X_calib, per_neuron=True):
+        """
+        Int8 kopija istrenirane mreze, samo za inferencu.
+        Skala ulaza svakog sloja se kalibrise na X_calib, a skala tezina je
+        po neuronu (per_neuron=True) ili jedna za ceo sloj.
+        """
+        import numpy as np
+
+        self.layers = []  # (skala ulaza, int8 tezine, skala tezina, int32 bias, aktivacija)
+        x = np.asarray(X_calib, dtype=np.float64)
+        for layer in nn.layers:
+            W = np.array([[mn.x[1] for mn in neuron.multiply_nodes[:-1]] for neuron in layer.neurons])
+            b = np.array([neuron.multiply_nodes[-1].x[1] for neuron in layer.neurons])
+
+            x_scale = float(_int8_scale(np.abs(x).max()))
+            if per_neuron:
+                w_scale = _int8_scale(np.abs(W).max(axis=1))
+            else:
+                w_scale = np.full(layer.n_neurons, _int8_scale(np.abs(W).max()))
+            W_q = np.clip(np.round(W / w_scale[:, None]), -127, 127).astype(np.int8)
+            # bias se cuva u int32, u skali akumulatora (x_scale * w_scale)
+            b_q = np.round(b / (x_scale * w_scale)).astype(np.int32)
+            self.layers.append((x_scale, W_q, w_scale, b_q, layer.activation))
+
+            x = _activate(x.dot(W.T) + b, layer.activation)  # float izlaz za kalibraciju sledeceg sloja
+
+    def predict_batch(self, X):
+        import numpy as np
+
+        x = np.asarray(X, dtype=np.float64)
+        for x_scale, W_q, w_scale, b_q, activation in self.layers:
+            x_q = np.clip(np.round(x / x_scale), -127, 127).astype(np.int32)
+            acc = x_q.dot(W_q.T.astype(np.int32)) + b_q  # celobrojni matricni proizvod
+            x = _activate(acc * (x_scale * w_scale), activation)
+        return x.tolist()
+
+    def predict(self, x):
+        return self.predict_batch([x])[0]
+
+
+def classification_accuracy(Y_pred, Y, threshold=0.5):
+    # udeo redova kod kojih su svi izlazi na pravoj strani praga
+    correct = 0
+    for y_pred, y in zip(Y_pred, Y):
+        if all((p > threshold) == (t > threshold) for p, t in zip(y_pred, y)):
+            correct += 1
+    return correct / len(Y) if Y else 0.
+
+
+def _timed_predict(nn, X, repeat=3):
+    # najbolje od 'repeat' merenja, da zagrevanje i sum ne bi uticali na poredjenje
+    import time
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        Y_pred = [nn._predict(x) for x in X]
+        best = min(best, time.perf_counter() - start)
+    return Y_pred, best
+
+
+def pruning_report(nn, X_test, Y_test, sparsity, X=None, Y=None, rounds=1, fine_tune_epochs=0,
+                   learning_rate=0.01, momentum=0.9, loss='mse', shuffle=False):
+    """
+    Orezivanje mreze do ciljnog udela nula u 'rounds' koraka, uz opciono
+    dotreniravanje (fit nad X, Y, sa istom funkcijom greske 'loss' kao pri treniranju)
+    posle svakog koraka, i prelazak na retki zapis.
+    :return: recnik sa postignutim udelom nula, ubrzanjem predict-a i promenom tacnosti.
+    """
+    # osnova se meri istom petljom kao i orezana mreza, samo preko svih tezina,
+    # pa ubrzanje zavisi samo od broja nenultih tezina (_predict zaobilazi kes)
+    nn.to_sparse()
+    dense_pred, dense_time = _timed_predict(nn, X_test)
+
+    for r in range(rounds):
+        nn.prune(sparsity=sparsity * (r + 1) / rounds)
+        if fine_tune_epochs > 0 and X is not None:
+            nn.fit(X, Y, learning_rate=learning_rate, momentum=momentum, nb_epochs=fine_tune_epochs,
+                   shuffle=shuffle, loss=loss)
+
+    sparse_pred, sparse_time = _timed_predict(nn, X_test)
+
+    dense_accuracy = classification_accuracy(dense_pred, Y_test)
+    sparse_accuracy = classification_accuracy(sparse_pred, Y_test)
+    return {
+        'sparsity': nn.sparsity(),
+        'speedup': dense_time / sparse_time if sparse_time > 0 else float('inf'),
+        'dense_accuracy': dense_accuracy,
+        'sparse_accuracy': sparse_accuracy,
+        'delta': sparse_accuracy - dense_accuracy,
+    }
+
+
+def quantization_report(nn, qnn, X, Y):
+    float_accuracy = classification_accuracy([nn.predict(x) for x in X], Y)
+    quantized_accuracy = classification_accuracy(qnn.predict_batch(X), Y)
+    return {
+        'float_accuracy': float_accuracy,
+        'quantized_accuracy': quantized_accuracy,
+        'delta': quantized_accuracy - float_accuracy,
+    }
+
 
 def encodinghot(fajl, kolone):
+    import pandas as pd
+
     ulaz = fajl
     for kolona in kolone:
-        ulaz  = pd.concat([ulaz, pd.get_dummies(ulaz[kolona], prefix=kolona, dummy_na=False)], axis=1).drop([kolona], axis=1)
+        ulaz  = pd.concat([ulaz, pd.get_dummies(ulaz[kolona], prefix=kolona, dummy_na=False, dtype=int)], axis=1).drop([kolona], axis=1)
     return  ulaz
 
-def normalizovanje(dataframe):
-    vrednosti = dataframe.values
-    min_max_skaler = preprocessing.MinMaxScaler()
-    vrednosti_skalirane = min_max_skaler.fit_transform(vrednosti)
-    return pd.DataFrame(vrednosti_skalirane)
+class Preprocessing(object):
+
+    def __init__(self, hot_columns):
+        """
+        Fitovano one-hot enkodovanje (encodinghot) i min-max normalizacija, koji
+        se mogu primeniti i na nove zapise sa istim kolonama i skalama.
+        :param hot_columns: kategoricke kolone koje se enkoduju.
+        """
+        self.hot_columns = hot_columns
+        self.categories = {}  # kategorije svake kategoricke kolone, u redosledu dummy kolona
+        self.columns = []  # kolone posle enkodovanja
+        self.min = []
+        self.max = []
+
+    def fit(self, dataframe):
+        import pandas as pd
+
+        dataframe = dataframe.fillna(0)
+        self.categories = {k: pd.Categorical(dataframe[k]).categories.tolist() for k in self.hot_columns}
+        encoded = self._encode(dataframe)
+        self.columns = encoded.columns.tolist()
+        vrednosti = encoded.values.astype(float)
+        self.min = vrednosti.min(axis=0).tolist()
+        self.max = vrednosti.max(axis=0).tolist()
+        return self
+
+    def transform(self, dataframe):
+        # vraca listu redova (lista float-ova), spremnu za NeuralNetwork
+        vrednosti = self._encode(dataframe.fillna(0))[self.columns].values.astype(float).tolist()
+        return [[(v - lo) / (hi - lo) if hi > lo else v - lo for v, lo, hi in zip(red, self.min, self.max)]
+                for red in vrednosti]
+
+    def transform_sparse(self, dataframe):
+        # kao transform, ali vraca SparseInput: numericke kolone gusto, kategoricke kao indekse
+        import pandas as pd
+
+        dataframe = dataframe.fillna(0)
+        n_dense = len(self.columns) - sum(len(self.categories[k]) for k in self.hot_columns)
+        dense = [[(v - lo) / (hi - lo) if hi > lo else v - lo for v, lo, hi in zip(red, self.min, self.max)]
+                 for red in dataframe[self.columns[:n_dense]].values.astype(float).tolist()]
+
+        codes = []
+        offset = 0
+        for k in self.hot_columns:
+            codes.append((offset, pd.Categorical(dataframe[k], categories=self.categories[k]).codes.tolist()))
+            offset += len(self.categories[k])
+        # konstantna one-hot kolona se normalizuje u 0, pa nije aktivna
+        varies = [hi > lo for lo, hi in zip(self.min[n_dense:], self.max[n_dense:])]
+
+        rows = []
+        for r, red in enumerate(dense):
+            active = [offset + c[r] for offset, c in codes if c[r] >= 0 and varies[offset + c[r]]]
+            rows.append(SparseInput(red, active))
+        return rows
+
+    def _encode(self, dataframe):
+        import pandas as pd
+
+        dataframe = dataframe.copy()
+        for k in self.hot_columns:  # fiksne kategorije, da bi nove serije imale iste dummy kolone
+            dataframe[k] = pd.Categorical(dataframe[k], categories=self.categories[k])
+        return encodinghot(dataframe, self.hot_columns)
+
+    def to_dict(self):
+        return {'hot_columns': self.hot_columns, 'categories': self.categories, 'columns': self.columns,
+                'min': self.min, 'max': self.max}
+
+    @staticmethod
+    def from_dict(data):
+        p = Preprocessing(data['hot_columns'])
+        p.categories = data['categories']
+        p.columns = data['columns']
+        p.min = data['min']
+        p.max = data['max']
+        return p
+
 
 if __name__ == '__main__':
+    import pandas as pd
+    from matplotlib import pyplot
+    from numpy.random import RandomState
+    from imblearn.over_sampling import ADASYN, SMOTE
 
     # pod a)
     smokes = smoked = never_smoked = 0
@@ -434,110 +1090,55 @@ if __name__ == '__main__':
     nn = NeuralNetwork()
 
     col_list = ["gender", "age","hypertension","heart_disease","ever_married",
-                "work_type","Residence_type","avg_glucose_level","bmi","smoking_status","stroke"]
+                "work_type","Residence_type","avg_glucose_level","bmi","smoking_status"]
 
 
     papo_ulaz  = pd.read_csv('../data/dataset.csv',usecols=col_list)
     papo_izlaz = pd.read_csv('../data/dataset.csv', usecols=["stroke"])
 
-    papo_ulaz.fillna(0, inplace=True)
     papo_izlaz.fillna(0, inplace=True)
 
 
     hotovane = ["gender", "ever_married", "Residence_type", "work_type", "smoking_status"]
 
+    # enkodovanje i normalizacija se fituju jednom, nad svim sirovim podacima, i cuvaju uz mrezu,
+    # da bi se novi zapisi (partial_fit, batch_scoring.py) pripremali na isti nacin
+    encodinghot(pd.concat([papo_ulaz, papo_izlaz], axis=1).fillna(0), hotovane).to_csv(
+        path_or_buf='../data/papo_ulaz.csv', index=False)  # enkodovani sirovi podaci, pre normalizacije
 
-    papo_ulaz = encodinghot(papo_ulaz, hotovane)
-    papo_ulaz.to_csv(path_or_buf='../data/papo_ulaz.csv', index=False)
+    prep = Preprocessing(hotovane).fit(papo_ulaz)
+    papo_ulaz = pd.DataFrame(prep.transform(papo_ulaz), columns=prep.columns)
 
 
     ada = ADASYN()
-    nova_lista = [member for member in range(22) if member != 5]
-    X_resampled, y_resampled = ada.fit_resample(papo_ulaz.iloc[:, nova_lista], papo_ulaz['stroke'])
+    X_resampled, y_resampled = ada.fit_resample(papo_ulaz, papo_izlaz['stroke'])
 
     # oversample = SMOTE()
-    # X_resampled, y_resampled= oversample.fit_resample(papo_ulaz.iloc[:, nova_lista], papo_ulaz['stroke']
-
-    papo_ulaz = pd.concat([pd.DataFrame(X_resampled), pd.DataFrame(y_resampled)], axis=1)
-
-
-    papo_izlaz = papo_ulaz["stroke"]
-
-    papo_ulaz_0=  papo_ulaz[papo_ulaz["stroke"] == 0]
-    papo_ulaz_1=  papo_ulaz[papo_ulaz["stroke"] == 1]
-
-    papo_ulaz_0 = papo_ulaz_0.drop(["stroke"], axis=1)
-    papo_ulaz_1 = papo_ulaz_1.drop(["stroke"], axis=1)
-
+    # X_resampled, y_resampled= oversample.fit_resample(papo_ulaz, papo_izlaz['stroke'])
 
-    papo_ulaz_0.to_csv(path_or_buf='../data/papo_ulaz_0.csv', index=False)
-    papo_ulaz_1.to_csv(path_or_buf='../data/papo_ulaz_1.csv', index=False)
-
-    papo_ulaz_0 = normalizovanje(papo_ulaz_0)
-    papo_ulaz_1 = normalizovanje(papo_ulaz_1)
-
-    #oversampling :D
-    #duzina_ulaza_1 = len(papo_ulaz_1)
-    #duzina_ulaza_0 = len(papo_ulaz_0)
-
-    #papo_ulaz_1_frames = [papo_ulaz_1,papo_ulaz_1,papo_ulaz_1,papo_ulaz_1,papo_ulaz_1,
-    #                      papo_ulaz_1,papo_ulaz_1,papo_ulaz_1,papo_ulaz_1,papo_ulaz_1,papo_ulaz_1]
-    #papo_ulaz_1 = pd.concat(papo_ulaz_1_frames)
-
-    papo_ulaz_0.to_csv(path_or_buf='../data/ulaz_0.csv', index=False)
-    papo_ulaz_1.to_csv(path_or_buf='../data/ulaz_1.csv', index=False)
+    papo_ulaz = pd.DataFrame(X_resampled, columns=prep.columns)
+    papo_izlaz = pd.DataFrame(y_resampled, columns=['stroke'])
     papo_izlaz.to_csv(path_or_buf='../data/izlaz.csv', index=False)
 
     nn.add(NeuralLayer(21, 21, 'tanh'))
     nn.add(NeuralLayer(21, 10, 'tanh'))
     nn.add(NeuralLayer(10, 1, 'sigmoid'))
+    nn.preprocessing = prep
+
+    # 35% svake klase za treniranje, ostatak za testiranje
+    ptrain_index = []
+    ptest_index = []
+    for klasa in [1, 0]:
+        indeksi = papo_izlaz.index[papo_izlaz['stroke'] == klasa]
+        train = indeksi.to_series().sample(frac=0.35, random_state=RandomState())
+        ptrain_index.extend(train.tolist())
+        ptest_index.extend(indeksi[~indeksi.isin(train)].tolist())
+
+    ptrain_ulaz = papo_ulaz.loc[ptrain_index]
+    ptest_ulaz = papo_ulaz.loc[ptest_index]
+    ptrain_izlaz = papo_izlaz.loc[ptrain_index]
+    ptest_izlaz = papo_izlaz.loc[ptest_index]
 
-    #polovina =  int((duzina_ulaza_1 + duzina_ulaza_0)/2)
-
-
-    #papo_ulaz_0 = papo_ulaz_0[:polovina]
-    #papo_ulaz_1 = papo_ulaz_1[:polovina]
-
-
-    ptrain_ulaz_1_7 =  papo_ulaz_1.sample(frac=0.35, random_state=RandomState())
-    ptrain_ulaz_1_3 =  papo_ulaz_1.loc[~papo_ulaz_1.index.isin(ptrain_ulaz_1_7.index)]
-
-    ptrain_ulaz_0_7 = papo_ulaz_0.sample(frac=0.35, random_state=RandomState())
-    ptrain_ulaz_0_3 = papo_ulaz_0.loc[~papo_ulaz_0.index.isin(ptrain_ulaz_0_7.index)]
-
-
-    ptrain_ulaz_frames = [ptrain_ulaz_1_7,ptrain_ulaz_0_7]
-    ptest_ulaz_frames = [ptrain_ulaz_1_3, ptrain_ulaz_0_3]
-
-    #ptrain_ulaz = papo_ulaz.sample(frac=0.35, random_state=RandomState())
-    #ptest_ulaz  = papo_ulaz.loc[~papo_ulaz.index.isin(ptrain_ulaz.index)]
-
-    ptrain_ulaz = pd.concat(ptrain_ulaz_frames)
-    ptest_ulaz = pd.concat(ptest_ulaz_frames)
-
-    # racnomerna raspodela izlaz
-    izlaz_1 = []
-    izlaz_0 = []
-
-    for row in papo_izlaz.values.tolist():
-        if row == 1:
-            izlaz_1.append(row)
-        elif row == 0:
-            izlaz_0.append(row)
-    df_izlaz1 = pd.DataFrame(izlaz_1)
-    df_izlaz0 = pd.DataFrame(izlaz_0)
-    ptrain_izlaz_1_7_1 = df_izlaz1.sample(frac=0.35, random_state=RandomState())
-    ptrain_izlaz_1_3_1 = df_izlaz1.loc[~df_izlaz1.index.isin(ptrain_izlaz_1_7_1.index)]
-
-    ptrain_izlaz_1_7_0 = df_izlaz0.sample(frac=0.35, random_state=RandomState())
-    ptrain_izlaz_1_3_0 = df_izlaz0.loc[~df_izlaz0.index.isin(ptrain_izlaz_1_7_0.index)]
-
-    ptrain_izlaz_frames = [ptrain_izlaz_1_7_1, ptrain_izlaz_1_7_0]
-    ptest_izlaz_frames = [ptrain_izlaz_1_3_1, ptrain_izlaz_1_3_0]
-
-    ptrain_izlaz = pd.concat(ptrain_izlaz_frames)
-    ptest_izlaz = pd.concat(ptest_izlaz_frames)
-    #ptrain_izlaz[1:]
     ptrain_ulaz.to_csv(path_or_buf='../data/trainingulaz.csv', index=False)
     ptrain_izlaz.to_csv(path_or_buf='../data/trainingizlaz.csv', index=False)
 
@@ -547,13 +1148,15 @@ if __name__ == '__main__':
 
     if input("Treniraj mrezu?(y/n)") == 'y':
          # plotovanje funkcije greske
-        history = nn.fit( X, Y, learning_rate=0.01, momentum=0.9, nb_epochs=10, shuffle=True, verbose=1)
+        history = nn.fit( X, Y, learning_rate=0.01, momentum=0.9, nb_epochs=10, shuffle=True, verbose=1, loss='bce')
         pyplot.plot(history)
+        nn.save('../data/model.json')  # mreza zajedno sa fitovanim Preprocessing-om
 
         tp = tn = fp = fn = 0
         precision = []
         test_X = ptest_ulaz.values.tolist()
         test_Y = ptest_izlaz.values.tolist()
+        nn.enable_cache(len(test_X))  # petlja ispod zove predict vise puta za isti red
         #matrica konfuzije
         for i, j in zip(test_X, test_Y):
             print([j[0],nn.predict(i)[0]])
@@ -580,6 +1183,7 @@ if __name__ == '__main__':
         print(tn)
         print( fp)
         print( fn)
+        print('Cache', nn.cache_info())
         try:
             accuracy = (tp + tn) / (tp + fp + fn + tn)
         except:
@@ -601,4 +1205,10 @@ if __name__ == '__main__':
         print('Precision:', round(precision, 2))
         print('Recall:', round(recall, 2))
         print('F1 je', round(2*f1, 2))
+
+        # int8 kvantizacija, kalibracija na uzorku podataka za treniranje
+        qnn = nn.quantize(random.sample(X, min(len(X), 500)))
+        report = quantization_report(nn, qnn, test_X, test_Y)
+        print('Int8 accuracy', round(report['quantized_accuracy'] * 100, 2), '%',
+              '(delta', round(report['delta'] * 100, 2), '%)')
         pyplot.show()
\ No newline at end of file
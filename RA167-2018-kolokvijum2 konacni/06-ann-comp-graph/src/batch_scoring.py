@@ -0,0 +1,74 @@
+"""
+Skorovanje velikih CSV fajlova mrezom sacuvanom sa NeuralNetwork.save.
+
+CSV se cita u delovima (chunk), svaki deo se enkoduje i normalizuje fitovanim
+Preprocessing-om iz modela i skoruje u posebnom procesu, jednim matricnim
+proizvodom po sloju za ceo deo (BatchNeuralNetwork), a predikcije se upisuju
+u izlazni fajl redom kojim su redovi u ulazu. U memoriji je istovremeno najvise
+2 * broj_procesa delova.
+
+Model se dobija pokretanjem ann_comp_graph.py (odgovor 'y' na "Treniraj mrezu?"):
+posle treniranja mreza se, zajedno sa fitovanim Preprocessing-om (nn.preprocessing),
+cuva u ../data/model.json. Moze se napraviti i rucno: nn.preprocessing = Preprocessing(...).fit(df),
+pa nn.save(putanja). Ulazni CSV treba da ima iste sirove kolone kao data/dataset.csv;
+visak kolona (npr. id, stroke) se ignorise.
+
+Primer:
+    python batch_scoring.py ../data/model.json ../data/dataset.csv ../data/predikcije.csv --workers 4
+"""
+import argparse
+import csv
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from ann_comp_graph import BatchNeuralNetwork, load_network
+
+_preprocessing = None  # ucitava se jednom po procesu
+_batch_nn = None  # matrice tezina, prave se jednom po procesu
+
+
+def _init_worker(model_path):
+    global _preprocessing, _batch_nn
+    nn = load_network(model_path)
+    _preprocessing = nn.preprocessing
+    _batch_nn = BatchNeuralNetwork(nn)
+
+
+def _score_chunk(chunk):
+    return _batch_nn.predict_batch(_preprocessing.transform(chunk))
+
+
+def score_csv(model_path, input_path, output_path, chunksize=10000, workers=None):
+    import pandas as pd
+
+    nn = load_network(model_path)
+    if nn.preprocessing is None:
+        raise RuntimeError('Model "{0}" has no fitted preprocessing.'.format(model_path))
+    n_outputs = nn.layers[-1].n_neurons
+    workers = workers or os.cpu_count() or 1
+
+    with open(output_path, 'w', newline='') as f, \
+            ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model_path,)) as executor:
+        writer = csv.writer(f)
+        writer.writerow(['prediction'] if n_outputs == 1 else ['prediction_{0}'.format(i) for i in range(n_outputs)])
+
+        pending = deque()  # redosled slanja je redosled upisa
+        for chunk in pd.read_csv(input_path, chunksize=chunksize):
+            pending.append(executor.submit(_score_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                writer.writerows(pending.popleft().result())
+        while pending:
+            writer.writerows(pending.popleft().result())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Skorovanje CSV fajla sacuvanom neuronskom mrezom.')
+    parser.add_argument('model', help='JSON fajl sacuvan sa NeuralNetwork.save (sa preprocessing-om)')
+    parser.add_argument('input', help='ulazni CSV sa istim kolonama kao podaci za treniranje')
+    parser.add_argument('output', help='izlazni CSV sa predikcijama')
+    parser.add_argument('--chunksize', type=int, default=10000, help='broj redova u jednom delu')
+    parser.add_argument('--workers', type=int, default=None, help='broj procesa (podrazumevano broj jezgara)')
+    args = parser.parse_args()
+
+    score_csv(args.model, args.input, args.output, args.chunksize, args.workers)
@@ -0,0 +1,47 @@
+"""
+Provera vremena ucitavanja modula ann_comp_graph (inferenca).
+
+Modul se uvozi u posebnom procesu, da kes uvezenih modula ne bi uticao na merenje.
+Skripta pada (AssertionError) ako je uvezena neka od teskih biblioteka ili ako
+uvoz traje duze od zadatog limita.
+
+Primer:
+    python bench_import.py --limit 0.5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ['pandas', 'matplotlib', 'sklearn', 'imblearn', 'tqdm', 'numpy']
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import ann_comp_graph
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % HEAVY_MODULES
+
+
+def measure_import(repeat=5):
+    # najbolje od 'repeat' merenja, svako u novom procesu
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', _CHILD], cwd=src_dir)
+        results.append(json.loads(out.decode().strip().splitlines()[-1]))
+    return min(results, key=lambda r: r['elapsed'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Provera vremena ucitavanja ann_comp_graph.')
+    parser.add_argument('--limit', type=float, default=0.5, help='najduze dozvoljeno vreme uvoza u sekundama')
+    parser.add_argument('--repeat', type=int, default=5, help='broj merenja')
+    args = parser.parse_args()
+
+    result = measure_import(args.repeat)
+    print('Import ann_comp_graph: {0:.4f} s'.format(result['elapsed']))
+    assert not result['loaded'], 'Heavy modules imported: {0}'.format(', '.join(result['loaded']))
+    assert result['elapsed'] < args.limit, 'Import took {0:.4f} s, limit is {1} s'.format(result['elapsed'], args.limit)
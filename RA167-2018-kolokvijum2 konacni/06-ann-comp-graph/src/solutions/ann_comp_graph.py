@@ -4,15 +4,6 @@ from abc import abstractmethod
 import math
 import random
 import copy
-import pandas as pd
-
-from numpy.lib.function_base import append
-import pandas as pd
-
-from numpy.random import RandomState
-from matplotlib import pyplot
-import random
-from tqdm import trange 
 
 random.seed(1337)
 